@@ -19,12 +19,21 @@
 # Classes :
 # - Explainer -> Parent class for the explainers
 # - LimeExplainer -> Lime Explainer wrapper class
+# - LinearExplanation -> Explanation of a linear model, with the same interface as Lime explanations
 
+import os
+import re
+import pickle
+import hashlib
 import logging
+import tempfile
+import threading
 import numpy as np
-from typing import Type, Union, Any
-from lime.explanation import Explanation
-from lime.lime_text import LimeTextExplainer
+from html import escape
+from joblib import Parallel, delayed
+from sklearn.multioutput import MultiOutputClassifier
+from typing import Type, Union, Any, Dict, List, Tuple
+from sklearn.multiclass import OneVsRestClassifier, OneVsOneClassifier
 
 from {{package_name}}.preprocessing import preprocess
 from {{package_name}}.models_training.model_class import ModelClass
@@ -71,12 +80,26 @@ class Explainer:
 class LimeExplainer(Explainer):
     '''Lime Explainer wrapper class'''
 
-    def __init__(self, model: Type[ModelClass], model_conf: dict) -> None:
+    def __init__(self, model: Type[ModelClass], model_conf: dict, predict_batch_size: int = 256, n_jobs: int = 1,
+                 cache_dir: Union[str, None] = None, feature_selection: str = 'highest_weights',
+                 split_expression: str = r'\W+', linear_fast_path: bool = False) -> None:
         ''' Initialization
 
         Args:
             model: A model instance with predict & predict_proba functions, and list_classes attribute
             model_conf (dict): The model's configuration
+        Kwargs:
+            predict_batch_size (int): Number of texts sent to the model's predict_proba function at once
+            n_jobs (int): Number of jobs used to score the batches in parallel (-1 to use all CPUs)
+                Only used if the model can be pickled (e.g. sklearn models), otherwise batches are scored sequentially
+            cache_dir (str): Directory where explanations are cached. If None, explanations are not cached.
+            feature_selection (str): Feature selection method used by Lime (cf. Lime documentation)
+                'highest_weights' fits a single model, whereas 'forward_selection' (used by 'auto' for 6 features or less)
+                fits a model per candidate feature and per step: slower, but may be slightly more faithful
+            split_expression (str): Regex used by Lime to split the texts into words
+            linear_fast_path (bool): If the model is a (mono-label) vectorizer + linear model pipeline (e.g. ModelTfidfSvm),
+                explanations are computed in closed form (coefficients * features values) instead of using Lime.
+                Much faster, but the words are the vectorizer features, and not the Lime ones.
         Raises:
             TypeError: If the provided model does not implement a `predict_proba` function
             TypeError: If the provided model does not have a `list_classes` attribute
@@ -91,12 +114,88 @@ class LimeExplainer(Explainer):
 
         self.model = model
         self.model_conf = model_conf
+        self.predict_batch_size = predict_batch_size
+        self.n_jobs = n_jobs
+        # Parallel scoring needs the model to be sent to the workers, i.e. to be picklable
+        self.model_is_picklable = False
+        if self.n_jobs != 1:
+            try:
+                pickle.dumps(self.model)
+                self.model_is_picklable = True
+            except Exception:
+                self.logger.warning("The model can't be pickled, its predictions won't be parallelized")
         self.class_names = self.model.list_classes
         # Our explainers will explain a prediction for a given class / label
         # These atributes are set on the fly
         self.current_class_or_label_index = 0
-        # Create the explainer
-        self.explainer = LimeTextExplainer(class_names=self.class_names)
+        # Get the preprocessor once and for all (and not for each Lime call)
+        self.preprocessor = preprocess.get_preprocessor(self.model_conf.get('preprocess_str', 'no_preprocess'))
+        # Cache of already preprocessed texts (Lime perturbations mask the same base text, so many are duplicates)
+        self.preprocess_cache: Dict[str, Any] = {}
+        self.preprocess_cache_size = 8192
+        # Disk cache of explanations
+        self.cache_dir = cache_dir
+        if self.cache_dir is not None and not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Explanations of the last explained text, per (class / label index, max_features, num_samples)
+        # Avoids splitting & explaining the same text again (e.g. explain_instance_as_html then explain_instance_as_list)
+        self.last_content_hash: Union[str, None] = None
+        self.last_explanations: Dict[tuple, Any] = {}
+        self.lock = threading.Lock()
+        # Linear models can be explained in closed form
+        self.linear_pipeline = None
+        if linear_fast_path:
+            self.linear_pipeline = self._get_linear_pipeline()
+            if self.linear_pipeline is None:
+                self.logger.warning("The model is not a vectorizer + linear model pipeline, we use Lime")
+        # Create the explainer (lime is imported here as it is only needed if we want explanations)
+        from lime.lime_text import LimeTextExplainer
+        self.feature_selection = feature_selection
+        self.split_expression = split_expression
+        self.explainer = LimeTextExplainer(class_names=self.class_names, feature_selection=self.feature_selection,
+                                           split_expression=self.split_expression)
+
+    def _get_linear_pipeline(self) -> Any:
+        '''Gets the pipeline of the model if it is a mono-label vectorizer + linear model pipeline
+
+        Returns:
+            (?): The sklearn pipeline, None if the model is not of this kind
+        '''
+        pipeline = getattr(self.model, 'pipeline', None)
+        if pipeline is None or getattr(self.model, 'multi_label', False) or len(getattr(pipeline, 'steps', [])) != 2:
+            return None
+        vectorizer, estimator = pipeline.steps[0][1], pipeline.steps[1][1]
+        if not hasattr(vectorizer, 'get_feature_names_out') or not hasattr(estimator, 'coef_'):
+            return None
+        # Wrappers may expose a coef_ property (e.g. OneVsRestClassifier in sklearn 1.0) that does not match the predictions
+        if isinstance(estimator, (OneVsRestClassifier, OneVsOneClassifier, MultiOutputClassifier)):
+            return None
+        return pipeline
+
+    def _explain_linear(self, content: str, max_features: int) -> 'LinearExplanation':
+        '''Explains a prediction of a linear model in closed form, for the current class / label index
+
+        The weight of each word is its coefficient (for the class) times its value in the vectorized text.
+
+        Args:
+            content (str): Text to be explained
+            max_features (int): Maximum number of features
+        Returns:
+            LinearExplanation: The explanation
+        '''
+        vectorizer, estimator = self.linear_pipeline.steps[0][1], self.linear_pipeline.steps[1][1]  # type: ignore
+        # Binary case : only one row of coefficients, for the positive class
+        coef = np.atleast_2d(estimator.coef_)
+        if coef.shape[0] == 1:
+            class_coef = coef[0] if self.current_class_or_label_index == 1 else -coef[0]
+        else:
+            class_coef = coef[self.current_class_or_label_index]
+        # Weights of the words present in the text
+        x = vectorizer.transform(self._preprocess([content])).tocsr()
+        words = vectorizer.get_feature_names_out()
+        weights = [(words[j], float(class_coef[j] * value)) for j, value in zip(x.indices, x.data)]
+        weights = sorted(weights, key=lambda w: abs(w[1]), reverse=True)[:max_features]
+        return LinearExplanation(self.current_class_or_label_index, weights, self.class_names)
 
     def classifier_fn(self, content_list: list) -> np.ndarray:
         '''Function to get probabilities from a list of (not preprocessed) texts
@@ -106,19 +205,123 @@ class LimeExplainer(Explainer):
         Returns:
             np.array: probabilities
         '''
-        # Get preprocessor
-        if 'preprocess_str' in self.model_conf.keys():
-            preprocess_str = self.model_conf['preprocess_str']
-        else:
-            preprocess_str = 'no_preprocess'
-        preprocessor = preprocess.get_preprocessor(preprocess_str)
         # Preprocess
-        content_prep = preprocessor(content_list)
-        # Get probabilities
-        return self.model.predict_proba(content_prep)
+        content_prep = self._preprocess(content_list)
+        # Get probabilities, per batch to limit memory consumption
+        batches = [content_prep[i:i + self.predict_batch_size] for i in range(0, len(content_prep), self.predict_batch_size)]
+        if self.model_is_picklable and len(batches) > 1:
+            # The bound method is given to delayed (and not a lambda) so that workers can unpickle it
+            probas = Parallel(n_jobs=self.n_jobs, backend='loky')(delayed(self.model.predict_proba)(batch) for batch in batches)
+        else:
+            probas = [self.model.predict_proba(batch) for batch in batches]
+        return np.concatenate(probas, axis=0)
+
+    def _apply_preprocessor(self, texts: list) -> list:
+        '''Applies the preprocessor to a list of texts
+
+        The preprocessors of the package work on whole batches of documents (cf. words_n_fun), hence they are called once
+        on the full list. A preprocessor flagged with `supports_batch = False` is instead mapped text by text (with n_jobs jobs).
+
+        Args:
+            texts (list): texts to be preprocessed
+        Returns:
+            list: preprocessed texts
+        '''
+        if getattr(self.preprocessor, 'supports_batch', True):
+            return list(self.preprocessor(texts))
+        return Parallel(n_jobs=self.n_jobs, batch_size='auto')(delayed(self.preprocessor)(text) for text in texts)
+
+    def _preprocess(self, content_list: list) -> np.ndarray:
+        '''Applies the preprocessing to a list of texts, only once per unique text
+
+        Args:
+            content_list (list): texts to be preprocessed
+        Returns:
+            np.ndarray: preprocessed texts
+        '''
+        # Get unique texts & the index of each text among them
+        text_to_idx: Dict[str, int] = {}
+        inverse = [text_to_idx.setdefault(text, len(text_to_idx)) for text in content_list]
+        unique_texts = list(text_to_idx.keys())
+        # Preprocess texts not already in cache
+        missing_texts = [text for text in unique_texts if text not in self.preprocess_cache]
+        if missing_texts:
+            if len(self.preprocess_cache) + len(missing_texts) > self.preprocess_cache_size:
+                self.preprocess_cache = {}
+            self.preprocess_cache.update(zip(missing_texts, self._apply_preprocessor(missing_texts)))
+        # Scatter results back
+        unique_prep = np.array([self.preprocess_cache[text] for text in unique_texts], dtype=object)
+        return np.take(unique_prep, inverse)
+
+    def _get_cache_path(self, content: str, max_features: int, num_samples: int) -> Union[str, None]:
+        '''Gets the path of the cached explanation of a text for the current class / label index
+
+        Args:
+            content (str): Text to be explained
+            max_features (int): Maximum number of features (cf. Lime documentation)
+            num_samples (int): Size of the neighborhood to learn the linear model (cf. Lime documentation)
+        Returns:
+            str: Path to the cached explanation (None if no cache)
+        '''
+        if self.cache_dir is None:
+            return None
+        model_version = f"{getattr(self.model, 'model_dir', '')}_{getattr(self.model, 'nb_fit', '')}"
+        content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        key = (f"{content_hash}_{self.current_class_or_label_index}_{max_features}_{num_samples}_{model_version}"
+               f"_{self.feature_selection}_{self.split_expression}")
+        return os.path.join(self.cache_dir, f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.pkl")
+
+    def _read_cache(self, cache_path: str) -> Any:
+        '''Reads an explanation from the cache
+
+        Args:
+            cache_path (str): Path to the cached explanation
+        Returns:
+            (?): The explanation, None if not cached or if the file can't be read (e.g. truncated)
+        '''
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            self.logger.warning(f"Can't read the cached explanation {cache_path}, it will be computed again")
+            return None
+
+    def _write_cache(self, cache_path: str, explanation: Any) -> None:
+        '''Writes an explanation in the cache
+
+        The explanation is written in a temporary file, then moved (atomic), so that other processes
+        sharing the cache directory never read a partially written file.
+
+        Args:
+            cache_path (str): Path to the cached explanation
+            explanation (?): The explanation
+        '''
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f"{os.path.basename(cache_path)}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(explanation, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            self.logger.warning(f"Can't write the explanation in the cache {cache_path}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def clear_cache(self) -> None:
+        '''Removes all the cached explanations (and only them)'''
+        with self.lock:
+            self.last_content_hash = None
+            self.last_explanations = {}
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return
+        # Only removes the files written by the explainer (sha1 names & their temporary files), the directory may contain other files
+        for filename in os.listdir(self.cache_dir):
+            if re.fullmatch(r'[0-9a-f]{40}\.pkl(\.\w+\.tmp)?', filename):
+                os.remove(os.path.join(self.cache_dir, filename))
 
     def explain_instance(self, content: str, class_or_label_index: Union[int, None] = None,
-                         max_features: int = 15, **kwargs):
+                         max_features: int = 15, num_samples: int = 1000, **kwargs):
         '''Explains a prediction
 
         This function calls the Lime module. It creates a linear model around the input text to evaluate
@@ -129,19 +332,45 @@ class LimeExplainer(Explainer):
         Kwargs:
             class_or_label_index (int): for classification only. Class or label index to be considered.
             max_features (int): Maximum number of features (cf. Lime documentation)
+            num_samples (int): Size of the neighborhood to learn the linear model (cf. Lime documentation)
+                Lower values are faster, but explanations become unstable below ~100 samples
         Returns:
             (?): An explanation object
         '''
-        # Set index
-        if class_or_label_index is not None:
-            self.current_class_or_label_index = class_or_label_index
-        else:
-            self.current_class_or_label_index = 1  # Def to 1
-        # Get explanations
-        return self.explainer.explain_instance(content, self.classifier_fn, labels=(self.current_class_or_label_index,), num_features=max_features)
+        # The explainer state (index, last explanations) is shared, hence the lock (e.g. streamlit threads)
+        with self.lock:
+            # Set index
+            if class_or_label_index is not None:
+                self.current_class_or_label_index = class_or_label_index
+            else:
+                self.current_class_or_label_index = 1  # Def to 1
+            # Closed form explanations for linear models
+            if self.linear_pipeline is not None:
+                return self._explain_linear(content, max_features)
+            # Try to get explanations from the last explained text
+            content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+            if content_hash != self.last_content_hash:
+                self.last_content_hash = content_hash
+                self.last_explanations = {}
+            key = (self.current_class_or_label_index, max_features, num_samples)
+            if key in self.last_explanations:
+                return self.last_explanations[key]
+            # Try to get explanations from cache
+            cache_path = self._get_cache_path(content, max_features, num_samples)
+            explanation = self._read_cache(cache_path) if cache_path is not None else None
+            if explanation is None:
+                # Get explanations
+                explanation = self.explainer.explain_instance(content, self.classifier_fn, labels=(self.current_class_or_label_index,),
+                                                              num_features=max_features, num_samples=num_samples)
+                # Save explanations in cache
+                if cache_path is not None:
+                    self._write_cache(cache_path, explanation)
+            # Return
+            self.last_explanations[key] = explanation
+            return explanation
 
     def explain_instance_as_html(self, content: str, class_or_label_index: Union[int, None] = None,
-                                 max_features: int = 15, **kwargs) -> str:
+                                 max_features: int = 15, num_samples: int = 1000, **kwargs) -> str:
         '''Explains a prediction - returns an HTML object
 
         Args:
@@ -149,13 +378,15 @@ class LimeExplainer(Explainer):
         Kwargs:
             class_or_label_index (int): for classification only. Class or label index to be considered.
             max_features (int): Maximum number of features (cf. Lime documentation)
+            num_samples (int): Size of the neighborhood to learn the linear model (cf. Lime documentation)
+                Lower values are faster, but explanations become unstable below ~100 samples
         Returns:
             str: An HTML code with the explanation
         '''
-        return self.explain_instance(content, class_or_label_index, max_features).as_html()
+        return self.explain_instance(content, class_or_label_index, max_features, num_samples).as_html()
 
     def explain_instance_as_list(self, content: str, class_or_label_index: Union[int, None] = None,
-                                 max_features: int = 15, **kwargs) -> list:
+                                 max_features: int = 15, num_samples: int = 1000, **kwargs) -> list:
         '''Explains a prediction - returns a list object
 
         Args:
@@ -163,12 +394,58 @@ class LimeExplainer(Explainer):
         Kwargs:
             class_or_label_index (int): for classification only. Class or label index to be considered.
             max_features (int): Maximum number of features (cf. Lime documentation)
+            num_samples (int): Size of the neighborhood to learn the linear model (cf. Lime documentation)
+                Lower values are faster, but explanations become unstable below ~100 samples
         Returns:
             list: List of tuples with words and corresponding weights
         '''
-        explanation = self.explain_instance(content, class_or_label_index, max_features)
-        # Return as list for selected class or label
-        return explanation.as_list(label=self.current_class_or_label_index)
+        explanation = self.explain_instance(content, class_or_label_index, max_features, num_samples)
+        # Return as list for selected class or label (the only one available in the explanation)
+        return explanation.as_list(label=explanation.available_labels()[0])
+
+
+class LinearExplanation:
+    '''Explanation of a linear model, with the same interface as Lime explanations (as_list, as_html & available_labels)'''
+
+    def __init__(self, label: int, weights: List[Tuple[str, float]], class_names: list) -> None:
+        '''Initialization
+
+        Args:
+            label (int): Class or label index explained
+            weights (list): List of tuples with words and corresponding weights
+            class_names (list): Names of the classes
+        '''
+        self.label = label
+        self.weights = weights
+        self.class_names = class_names
+
+    def available_labels(self) -> list:
+        '''Gets the explained labels
+
+        Returns:
+            list: Class or label indexes explained
+        '''
+        return [self.label]
+
+    def as_list(self, label: Union[int, None] = None, **kwargs) -> list:
+        '''Gets the explanation as a list
+
+        Kwargs:
+            label (int): Class or label index (only the explained one is available)
+        Returns:
+            list: List of tuples with words and corresponding weights
+        '''
+        return list(self.weights)
+
+    def as_html(self, **kwargs) -> str:
+        '''Gets the explanation as an HTML table
+
+        Returns:
+            str: An HTML code with the explanation
+        '''
+        rows = ''.join(f"<tr><td>{escape(str(word))}</td><td>{weight:.4f}</td></tr>" for word, weight in self.weights)
+        return (f"<p>Class: {escape(str(self.class_names[self.label]))}</p>"
+                f"<table><tr><th>Word</th><th>Weight</th></tr>{rows}</table>")
 
 
 if __name__ == '__main__':
@@ -25,6 +25,7 @@ import pickle
 import shutil
 import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
 from {{package_name}} import utils
 from {{package_name}}.monitoring.model_explainer import LimeExplainer
@@ -89,6 +90,35 @@ class ModelExplainerTest(unittest.TestCase):
         explanation = explainer.explain_instance(content="ceci est un test", class_or_label_index=None)
         html = explainer.explain_instance_as_html(content="ceci est un test", class_or_label_index=None)
         exp_list = explainer.explain_instance_as_list(content="ceci est un test", class_or_label_index=None)
+        explanation = explainer.explain_instance(content="ceci est un test", class_or_label_index=1, num_samples=200)
+        exp_list = explainer.explain_instance_as_list(content="ceci est un test", class_or_label_index=1, max_features=2, num_samples=200)
+        self.assertLessEqual(len(exp_list), 2)
+        explainer = LimeExplainer(model, model_conf, split_expression=r'\s+')
+        explanation = explainer.explain_instance(content="ceci, est un test", class_or_label_index=1, num_samples=200)
+        self.assertTrue('ceci,' in explanation.domain_mapper.indexed_string.inverse_vocab)
+        self.assertTrue(explainer.explain_instance(content="ceci, est un test", class_or_label_index=1, num_samples=200) is explanation)
+        # as_html & as_list on the same text -> only one Lime run
+        explainer = LimeExplainer(model, model_conf)
+        with patch.object(explainer.explainer, 'explain_instance', wraps=explainer.explainer.explain_instance) as mock_explain:
+            html = explainer.explain_instance_as_html(content="ceci est un test", class_or_label_index=0, num_samples=200)
+            exp_list = explainer.explain_instance_as_list(content="ceci est un test", class_or_label_index=0, num_samples=200)
+            self.assertEqual(mock_explain.call_count, 1)
+            exp_list = explainer.explain_instance_as_list(content="ceci est un test", class_or_label_index=1, num_samples=200)
+            exp_list = explainer.explain_instance_as_list(content="pas cela", class_or_label_index=0, num_samples=200)
+            self.assertEqual(mock_explain.call_count, 3)
+        # Concurrent calls on the same text -> only one Lime run, same explanation for all threads
+        explainer = LimeExplainer(model, model_conf)
+        with patch.object(explainer.explainer, 'explain_instance', wraps=explainer.explainer.explain_instance) as mock_explain:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                futures = [executor.submit(explainer.explain_instance_as_list if i % 2 else explainer.explain_instance_as_html,
+                                           content="ici test", class_or_label_index=1, num_samples=200) for i in range(8)]
+                results = [future.result() for future in futures]
+            self.assertEqual(mock_explain.call_count, 1)
+        self.assertTrue(all(result == results[1] for result in results[1::2]))
+        self.assertTrue(all(result == results[0] for result in results[0::2]))
+        explainer = LimeExplainer(model, model_conf, feature_selection='auto')
+        exp_list = explainer.explain_instance_as_list(content="ceci est un test", class_or_label_index=1, max_features=2, num_samples=200)
+        self.assertLessEqual(len(exp_list), 2)
         remove_dir(model_dir)
 
         # Mono-label - Multi classes
@@ -140,6 +170,171 @@ class ModelExplainerTest(unittest.TestCase):
         with self.assertRaises(TypeError):
             LimeExplainer(FakeModelClass(), model_conf)
 
+    def test02_lime_explainer_classifier_fn(self):
+        '''Test of the method classifier_fn of the Lime explainer'''
+
+        # Model dir
+        model_dir = os.path.join(os.getcwd(), 'model_test_123456789')
+        remove_dir(model_dir)
+        # fake model_conf
+        model_conf = {'preprocess_str': 'no_preprocess'}
+        # Set vars
+        x_train = np.array(["ceci est un test", "pas cela", "cela non plus", "ici test", "là, rien!"] * 100)
+        y_train_mono_2 = np.array(['y_0', 'y_1', 'y_0', 'y_1', 'y_1'] * 100)
+        model = ModelTfidfSvm(model_dir=model_dir, multi_label=False)
+        model.fit(x_train, y_train_mono_2)
+        explainer = LimeExplainer(model, model_conf)
+
+        # Nominal case, with duplicates
+        content_list = ["ceci est un test", "pas cela", "ceci est un test", "ici test", "pas cela"]
+        probas = explainer.classifier_fn(content_list)
+        np.testing.assert_almost_equal(probas, model.predict_proba(content_list))
+        self.assertEqual(len(explainer.preprocess_cache), 3)
+        # Second call reuses the cache
+        probas = explainer.classifier_fn(content_list[::-1])
+        np.testing.assert_almost_equal(probas, model.predict_proba(content_list[::-1]))
+        self.assertEqual(len(explainer.preprocess_cache), 3)
+
+        # Preprocessor without batch support
+        def fake_preprocessor(text):
+            return text
+        fake_preprocessor.supports_batch = False
+        explainer = LimeExplainer(model, model_conf)
+        explainer.preprocessor = fake_preprocessor
+        probas = explainer.classifier_fn(content_list)
+        np.testing.assert_almost_equal(probas, model.predict_proba(content_list))
+
+        # Mini-batches
+        explainer = LimeExplainer(model, model_conf, predict_batch_size=2)
+        probas = explainer.classifier_fn(content_list)
+        self.assertEqual(probas.shape, (len(content_list), len(model.list_classes)))
+        np.testing.assert_almost_equal(probas, model.predict_proba(content_list))
+
+        # Parallel
+        explainer = LimeExplainer(model, model_conf, predict_batch_size=2, n_jobs=2)
+        self.assertTrue(explainer.model_is_picklable)
+        probas = explainer.classifier_fn(content_list)
+        np.testing.assert_almost_equal(probas, model.predict_proba(content_list))
+        remove_dir(model_dir)
+
+    def test03_lime_explainer_cache(self):
+        '''Test of the disk cache of the Lime explainer'''
+
+        # Model dir
+        model_dir = os.path.join(os.getcwd(), 'model_test_123456789')
+        remove_dir(model_dir)
+        cache_dir = os.path.join(os.getcwd(), 'cache_test_123456789')
+        remove_dir(cache_dir)
+        # fake model_conf
+        model_conf = {'preprocess_str': 'no_preprocess'}
+        # Set vars
+        x_train = np.array(["ceci est un test", "pas cela", "cela non plus", "ici test", "là, rien!"] * 100)
+        y_train_mono_2 = np.array(['y_0', 'y_1', 'y_0', 'y_1', 'y_1'] * 100)
+        model = ModelTfidfSvm(model_dir=model_dir, multi_label=False)
+        model.fit(x_train, y_train_mono_2)
+        explainer = LimeExplainer(model, model_conf, cache_dir=cache_dir)
+        self.assertTrue(os.path.isdir(cache_dir))
+
+        # Nominal case
+        exp_list = explainer.explain_instance_as_list(content="ceci est un test", class_or_label_index=1, num_samples=200)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        # Same explanation -> read from cache
+        with patch.object(explainer.explainer, 'explain_instance') as mock_explain:
+            exp_list_cached = explainer.explain_instance_as_list(content="ceci est un test", class_or_label_index=1, num_samples=200)
+            mock_explain.assert_not_called()
+        self.assertEqual(exp_list, exp_list_cached)
+        # Other class -> new explanation
+        explainer.explain_instance(content="ceci est un test", class_or_label_index=0, num_samples=200)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+        # Other Lime settings -> other explanations
+        for other_explainer in [LimeExplainer(model, model_conf, cache_dir=cache_dir, feature_selection='auto'),
+                                LimeExplainer(model, model_conf, cache_dir=cache_dir, split_expression=r'\s+')]:
+            with patch.object(other_explainer.explainer, 'explain_instance', wraps=other_explainer.explainer.explain_instance) as mock_explain:
+                other_explainer.explain_instance(content="ceci est un test", class_or_label_index=1, num_samples=200)
+                mock_explain.assert_called_once()
+        self.assertEqual(len(os.listdir(cache_dir)), 4)
+        # Truncated cache file (e.g. process killed while writing) -> computed again & overwritten
+        files_before = set(os.listdir(cache_dir))
+        explainer.explain_instance(content="ici test", class_or_label_index=1, num_samples=200)
+        cache_path = os.path.join(cache_dir, (set(os.listdir(cache_dir)) - files_before).pop())
+        with open(cache_path, 'r+b') as f:
+            f.truncate(10)
+        new_explainer = LimeExplainer(model, model_conf, cache_dir=cache_dir)
+        with patch.object(new_explainer.explainer, 'explain_instance', wraps=new_explainer.explainer.explain_instance) as mock_explain:
+            new_explainer.explain_instance(content="ici test", class_or_label_index=1, num_samples=200)
+            mock_explain.assert_called_once()
+        with open(cache_path, 'rb') as f:
+            pickle.load(f)
+        self.assertEqual(len(os.listdir(cache_dir)), 5)  # No temporary file left
+        # Clear cache -> other files are kept (temporary files are removed)
+        with open(os.path.join(cache_dir, 'preprocess_pipeline.pkl'), 'wb') as f:
+            pickle.dump({'test': 1}, f)
+        with open(f"{cache_path}.abc_123.tmp", 'wb') as f:
+            f.write(b'test')
+        explainer.clear_cache()
+        self.assertEqual(os.listdir(cache_dir), ['preprocess_pipeline.pkl'])
+
+        # Clean
+        remove_dir(model_dir)
+        remove_dir(cache_dir)
+
+    def test04_lime_explainer_linear_fast_path(self):
+        '''Test of the closed form explanations of linear models'''
+
+        # Model dir
+        model_dir = os.path.join(os.getcwd(), 'model_test_123456789')
+        remove_dir(model_dir)
+        # fake model_conf
+        model_conf = {'preprocess_str': 'no_preprocess'}
+        # Set vars
+        x_train = np.array(["ceci est un test", "pas cela", "cela non plus", "ici test", "là, rien!"] * 100)
+        y_train_mono_2 = np.array(['y_0', 'y_1', 'y_0', 'y_1', 'y_1'] * 100)
+        y_train_mono_3 = np.array(['y_0', 'y_1', 'y_0', 'y_1', 'y_2'] * 100)
+        y_train_multi = pd.DataFrame({'test1': [0, 0, 0, 1, 0] * 100, 'test2': [1, 0, 0, 0, 0] * 100, 'test3': [0, 0, 0, 1, 0] * 100})
+
+        # Mono-label - Mono class
+        model = ModelTfidfSvm(model_dir=model_dir, multi_label=False)
+        model.fit(x_train, y_train_mono_2)
+        explainer = LimeExplainer(model, model_conf, linear_fast_path=True)
+        self.assertTrue(explainer.linear_pipeline is not None)
+        with patch.object(explainer.explainer, 'explain_instance') as mock_explain:
+            exp_list_0 = explainer.explain_instance_as_list(content="ceci est un test", class_or_label_index=0)
+            exp_list_1 = explainer.explain_instance_as_list(content="ceci est un test", class_or_label_index=1, max_features=2)
+            html = explainer.explain_instance_as_html(content="ceci est un test", class_or_label_index=1)
+            mock_explain.assert_not_called()
+        self.assertEqual(sorted([word for word, _ in exp_list_0]), ['ceci', 'est', 'test', 'un'])
+        self.assertEqual(len(exp_list_1), 2)
+        weights_0 = dict(exp_list_0)
+        for word, weight in exp_list_1:
+            self.assertAlmostEqual(weight, -weights_0[word])
+        self.assertTrue(isinstance(html, str))
+        remove_dir(model_dir)
+
+        # Mono-label - Multi classes
+        model = ModelTfidfSvm(model_dir=model_dir, multi_label=False)
+        model.fit(x_train, y_train_mono_3)
+        explainer = LimeExplainer(model, model_conf, linear_fast_path=True)
+        exp_list = explainer.explain_instance_as_list(content="ceci est un test", class_or_label_index=2)
+        self.assertEqual(sorted([word for word, _ in exp_list]), ['ceci', 'est', 'test', 'un'])
+        remove_dir(model_dir)
+
+        # Not managed -> Lime
+        model = ModelTfidfSvm(model_dir=model_dir, multi_label=True)
+        model.fit(x_train, y_train_multi)
+        explainer = LimeExplainer(model, model_conf, linear_fast_path=True)
+        self.assertTrue(explainer.linear_pipeline is None)
+        remove_dir(model_dir)
+        model = ModelTfidfSvm(model_dir=model_dir, multi_label=False, multiclass_strategy='ovr')
+        model.fit(x_train, y_train_mono_3)
+        explainer = LimeExplainer(model, model_conf, linear_fast_path=True)
+        self.assertTrue(explainer.linear_pipeline is None)
+        remove_dir(model_dir)
+        model = ModelTfidfSvm(model_dir=model_dir, multi_label=False, multiclass_strategy='ovo')
+        model.fit(x_train, y_train_mono_3)
+        explainer = LimeExplainer(model, model_conf, linear_fast_path=True)
+        self.assertTrue(explainer.linear_pipeline is None)
+        remove_dir(model_dir)
+
 
 # Perform tests
 if __name__ == '__main__':
@@ -58,7 +58,7 @@ class ModelKeras(ModelClass):
     # -> reload_from_standalone
 
     def __init__(self, batch_size: int = 64, epochs: int = 99, validation_split: float = 0.2,
-                 patience: int = 5, keras_params: Union[dict, None] = None, **kwargs) -> None:
+                 patience: int = 5, keras_params: Union[dict, None] = None, tf_threads: Union[int, None] = None, **kwargs) -> None:
         '''Initialization of the class (see ModelClass for more arguments)
 
         Kwargs:
@@ -71,6 +71,9 @@ class ModelKeras(ModelClass):
                 e.g. learning_rate, nb_lstm_units, etc...
                 The purpose of this dictionary is for the user to use it as they wants in the _get_model function
                 This parameter was initially added in order to do an hyperparameters search
+            tf_threads (int): Number of threads of the TensorFlow intra op. pool (inter op. : 2)
+                WARNING : this configuration is process-wide and can only be done before TensorFlow is initialized
+                If None, TensorFlow default configuration is kept
         '''
         # TODO: learning rate should be an attribute !
         # Init.
@@ -84,6 +87,14 @@ class ModelKeras(ModelClass):
         # Get logger (must be done after super init)
         self.logger = logging.getLogger(__name__)
 
+        # Configure tensorflow threads pools (opt-in)
+        if tf_threads is not None:
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(tf_threads)
+                tf.config.threading.set_inter_op_parallelism_threads(2)
+            except RuntimeError:
+                self.logger.warning("TensorFlow already initialized, can't configure its threads pools")
+
         # Param. model
         self.batch_size = batch_size
         self.epochs = epochs
@@ -401,6 +412,8 @@ class ModelKeras(ModelClass):
 
         Args:
             x_test (pd.DataFrame): Array-like, shape = [n_samples, n_features]
+        Kwargs:
+            experimental_version (bool): If an experimental (but faster) version must be used (given to predict)
         Raises:
             ValueError: If model not classifier
         Returns:
@@ -413,7 +426,7 @@ class ModelKeras(ModelClass):
         x_test, _ = self._check_input_format(x_test)
 
         # We use predict again
-        return self.predict(x_test, return_proba=True)
+        return self.predict(x_test, return_proba=True, **kwargs)
 
     @utils.trained_needed
     def experimental_predict_proba(self, x_test: pd.DataFrame) -> np.ndarray:
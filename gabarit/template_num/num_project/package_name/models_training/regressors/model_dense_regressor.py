@@ -22,16 +22,28 @@
 
 import os
 import json
+import mmap
 import shutil
 import logging
-import dill as pickle
-from typing import Union, List, Callable
-
+import threading
+import dill
+import numpy as np
+import pandas as pd
+import pickle
+from typing import Union, List, Callable, Any
+
+import tensorflow as tf
 from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.models import load_model as load_model_keras
-from tensorflow.keras.layers import ELU, BatchNormalization, Dense, Dropout, Input
+from tensorflow.keras.layers import ELU, BatchNormalization, Dense, Dropout, Input, InputLayer
+
+try:
+    import orjson  # Optional, faster json decoding
+except ImportError:
+    orjson = None
 
+from {{package_name}} import utils
 from {{package_name}}.models_training import utils_deep_keras
 from {{package_name}}.models_training.model_keras import ModelKeras
 from {{package_name}}.models_training.regressors.model_regressor import ModelRegressorMixin  # type: ignore
@@ -50,6 +62,29 @@ class ModelDenseRegressor(ModelRegressorMixin, ModelKeras):
         # Get logger (must be done after super init)
         self.logger = logging.getLogger(__name__)
 
+        # Traced forward pass & quantized interpreter, built on the fly (cf. _get_predict_tf & _quant_predict)
+        self._predict_tf: Any = None
+        self._quant_interpreter: Any = None
+        self._quant_lock: Any = threading.Lock()
+        # Thread saving the model as png (cf. _get_model)
+        self._save_png_thread: Any = None
+
+    def fit(self, x_train, y_train, x_valid=None, y_valid=None, with_shuffle: bool = True, **kwargs) -> None:
+        '''Fits the model (see ModelKeras), then resets the traced forward pass caches
+
+        Args:
+            x_train (?): Array-like, shape = [n_samples, n_features]
+            y_train (?): Array-like, shape = [n_samples, n_targets]
+        Kwargs:
+            x_valid (?): Array-like, shape = [n_samples, n_features]
+            y_valid (?): Array-like, shape = [n_samples, n_targets]
+            with_shuffle (bool): If x, y must be shuffled before fitting
+        '''
+        super().fit(x_train, y_train, x_valid=x_valid, y_valid=y_valid, with_shuffle=with_shuffle, **kwargs)
+        # The weights changed (the Keras model may be the same object, e.g. with level_save='LOW'), so we reset the caches
+        self._predict_tf = None
+        self._quant_interpreter = None
+
     def _get_model(self) -> Model:
         '''Gets a model structure
 
@@ -84,7 +119,7 @@ class ModelDenseRegressor(ModelRegressorMixin, ModelKeras):
         decay = self.keras_params['decay'] if 'decay' in self.keras_params.keys() else 0.0
         self.logger.info(f"Learning rate: {lr}")
         self.logger.info(f"Decay: {decay}")
-        optimizer = Adam(lr=lr, decay=decay)
+        optimizer = Adam(learning_rate=lr, decay=decay)
 
         # Set loss & metrics
         loss = 'mean_squared_error'  # could be 'mean_absolute_error'
@@ -96,12 +131,214 @@ class ModelDenseRegressor(ModelRegressorMixin, ModelKeras):
             model.summary()
 
         # Try to save model as png if level_save > 'LOW'
+        # Done in a background thread as it may be slow (graphviz). We first wait for the previous one (same model_dir)
         if self.level_save in ['MEDIUM', 'HIGH']:
-            self._save_model_png(model)
+            self._join_save_png_thread()
+            self._save_png_thread = threading.Thread(target=self._save_model_png, args=(model,))
+            self._save_png_thread.start()
 
         # Return
         return model
 
+    def _join_save_png_thread(self) -> None:
+        '''Waits for the thread saving the model as png, if any (cf. _get_model)'''
+        save_png_thread = getattr(self, '_save_png_thread', None)
+        if save_png_thread is not None:
+            save_png_thread.join()
+
+    def _get_predict_tf(self) -> Callable:
+        '''Gets the forward pass of the model, as a tf.function traced with a fixed input signature
+
+        Hence, it is traced only once, whatever the batch size. It is built again if the model changed (e.g. after a fit or a reload).
+
+        Returns:
+            Callable: The forward pass
+        '''
+        predict_tf = getattr(self, '_predict_tf', None)
+        if predict_tf is None or predict_tf[0] is not self.model:
+            model = self.model
+            try:
+                inference_model = self._get_inference_model(model)
+                input_signature = [tf.TensorSpec([None, inference_model.input_shape[-1]], tf.float32)]
+                fn = tf.function(lambda x: inference_model(x, training=False), input_signature=input_signature)
+            except Exception:
+                # _get_model may have been changed (e.g. not a simple stack of layers), backup on the model itself
+                self.logger.warning("Can't build the inference model, backup on the model itself")
+                fn = tf.function(lambda x: model(x, training=False))
+            self._predict_tf = (model, fn)
+        return self._predict_tf[1]
+
+    def warm_up_predict(self, experimental_version: Union[bool, str] = True) -> None:
+        '''Builds the forward pass of an experimental version with a dummy batch, so that the first predictions do not pay for it
+        - Opt-in, e.g. call it before a loop of predictions (the explainers call it if they use an experimental version) -
+
+        The input signature of the traced forward pass is fixed, hence one call covers every batch size.
+
+        Kwargs:
+            experimental_version (bool | str): The experimental version to be warmed up (cf. _predict_regressor)
+        '''
+        if self.model is None or not experimental_version:
+            return
+        try:
+            x_dummy = np.zeros((1, self.model.input_shape[-1]), dtype=np.float32)
+            if experimental_version == 'quantized':
+                self._quant_predict(x_dummy)
+            else:
+                self._get_predict_tf()(x_dummy)
+        except Exception as e:
+            self.logger.warning("Can't warm up the forward pass of the experimental version")
+            self.logger.warning(repr(e))
+
+    def _get_inference_model(self, model: Model) -> Model:
+        '''Gets an inference only version of a model, with fewer operations
+
+        Dropout layers are removed (identity at inference), and BatchNormalization layers are folded into the preceding
+        Dense layers (BN is an affine transformation at inference), i.e. W' = W * gamma / sqrt(var + eps) and
+        b' = (b - mean) * gamma / sqrt(var + eps) + beta. ELU layers (alpha=1) following them become Dense activations.
+        The model must be a simple stack of layers.
+
+        Args:
+            model (Model): The model to be fused
+        Returns:
+            Model: The inference model
+        '''
+        layers = [layer for layer in model.layers if not isinstance(layer, (InputLayer, Dropout))]
+        input_layer = Input(shape=model.input_shape[1:])
+        x = input_layer
+        i = 0
+        while i < len(layers):
+            layer = layers[i]
+            next_layer = layers[i + 1] if i + 1 < len(layers) else None
+            # Nominal case, layer kept as is
+            if not isinstance(layer, Dense) or not isinstance(next_layer, BatchNormalization) or layer.activation.__name__ != 'linear':
+                x = layer(x)
+                i += 1
+                continue
+            # Fold BN into the Dense layer
+            kernel = layer.kernel.numpy()
+            bias = layer.bias.numpy() if layer.use_bias else np.zeros(kernel.shape[-1], dtype=kernel.dtype)
+            gamma = next_layer.gamma.numpy() if next_layer.scale else 1.0
+            beta = next_layer.beta.numpy() if next_layer.center else 0.0
+            bn_scale = gamma / np.sqrt(next_layer.moving_variance.numpy() + next_layer.epsilon)
+            fused_weights = [kernel * bn_scale, (bias - next_layer.moving_mean.numpy()) * bn_scale + beta]
+            i += 2
+            # Merge a following ELU layer (alpha=1) as activation
+            activation = None
+            if i < len(layers) and isinstance(layers[i], ELU) and float(layers[i].alpha) == 1.0:
+                activation = 'elu'
+                i += 1
+            fused_layer = Dense(kernel.shape[-1], activation=activation)
+            x = fused_layer(x)
+            fused_layer.set_weights(fused_weights)
+        return Model(inputs=input_layer, outputs=[x])
+
+    @utils.trained_needed
+    def experimental_predict_proba(self, x_test: pd.DataFrame) -> np.ndarray:
+        '''Predictions on test set - simple pass forward - experimental
+
+        Contrary to ModelKeras.experimental_predict_proba, the forward pass is not traced again for each call.
+
+        Args:
+            x_test (pd.DataFrame): Array-like, shape = [n_samples, n_features]
+        Returns:
+            (np.ndarray): Array, shape = [n_samples, 1]
+        '''
+        return self._get_predict_tf()(np.asarray(x_test, dtype=np.float32)).numpy()
+
+    @utils.trained_needed
+    def _predict_regressor(self, x_test, experimental_version: Union[bool, str] = False) -> np.ndarray:
+        '''Predictions on test
+
+        Args:
+            x_test (pd.DataFrame): DataFrame with the test data to be predicted
+        Kwargs:
+            experimental_version (bool | str): If an experimental (but faster) version must be used
+                If 'quantized', a TFLite quantized version of the model is used (cf. _quant_predict)
+        Raises:
+            ValueError: If the model is not of regressor type
+        Returns:
+            (np.ndarray): Array, shape = [n_samples]
+        '''
+        if experimental_version != 'quantized':
+            return super()._predict_regressor(x_test, experimental_version=experimental_version)
+        if self.model_type != 'regressor':
+            raise ValueError(f"Models of type {self.model_type} do not implement the method predict_regressor")
+        return np.array([pred[0] for pred in self._quant_predict(x_test)])
+
+    def _quant_predict(self, x_test: pd.DataFrame) -> np.ndarray:
+        '''Predictions on test set with a TFLite quantized version of the model - experimental
+
+        Weights are quantized to int8 (dynamic range quantization, no representative dataset needed), which is
+        faster on CPU for large batches of predictions (e.g. explainers). Predictions are slightly less precise.
+        Backup on the float traced forward pass if the conversion is not possible.
+        The interpreter is shared, hence calls are serialized with a lock.
+
+        Args:
+            x_test (pd.DataFrame): Array-like, shape = [n_samples, n_features]
+        Returns:
+            (np.ndarray): Array, shape = [n_samples, 1]
+        '''
+        x_test = np.ascontiguousarray(x_test, dtype=np.float32)
+        with self._quant_lock:
+            quant_interpreter = getattr(self, '_quant_interpreter', None)
+            if quant_interpreter is None or quant_interpreter[0] is not self.model:
+                try:
+                    converter = tf.lite.TFLiteConverter.from_keras_model(self._get_inference_model(self.model))
+                    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                    interpreter = tf.lite.Interpreter(model_content=converter.convert())
+                    interpreter.allocate_tensors()
+                except Exception:
+                    self.logger.warning("Can't convert the model to TFLite, backup on the float version")
+                    interpreter = None
+                self._quant_interpreter = (self.model, interpreter)
+            interpreter = self._quant_interpreter[1]
+            if interpreter is None:
+                return self._get_predict_tf()(x_test).numpy()
+            input_details = interpreter.get_input_details()[0]
+            output_index = interpreter.get_output_details()[0]['index']
+            # Resize input only if the batch size changed
+            if tuple(input_details['shape']) != x_test.shape:
+                interpreter.resize_tensor_input(input_details['index'], list(x_test.shape))
+                interpreter.allocate_tensors()
+            interpreter.set_tensor(input_details['index'], x_test)
+            interpreter.invoke()
+            return interpreter.get_tensor(output_index).copy()
+
+    def save(self, json_data: Union[dict, None] = None) -> None:
+        '''Saves the model
+
+        Kwargs:
+            json_data (dict): Additional configurations to be saved
+        '''
+        # The png must be fully written when the model is saved
+        self._join_save_png_thread()
+        # The traced forward pass, the quantized interpreter (& its lock) & the png thread can't be pickled,
+        # so we drop them, save, and set them back
+        predict_tf = getattr(self, '_predict_tf', None)
+        quant_interpreter = getattr(self, '_quant_interpreter', None)
+        quant_lock = getattr(self, '_quant_lock', None)
+        save_png_thread = getattr(self, '_save_png_thread', None)
+        self._predict_tf = None
+        self._quant_interpreter = None
+        self._quant_lock = None
+        self._save_png_thread = None
+        super().save(json_data=json_data)
+        self._predict_tf = predict_tf
+        self._quant_interpreter = quant_interpreter
+        self._quant_lock = quant_lock
+        self._save_png_thread = save_png_thread
+
+    def __setstate__(self, state: dict) -> None:
+        '''Sets the state of the model when it is unpickled (e.g. reloaded from its .pkl file)
+
+        The lock of the quantized interpreter is not saved (cf. save), so we create a new one here, before any thread can use the model.
+
+        Args:
+            state (dict): The state of the model
+        '''
+        self.__dict__.update(state)
+        self._quant_lock = threading.Lock()
+
     def reload_from_standalone(self, **kwargs) -> None:
         '''Reloads a model from its configuration and "standalones" files
         - /!\\ Experimental /!\\ -
@@ -137,9 +374,17 @@ class ModelDenseRegressor(ModelRegressorMixin, ModelKeras):
         if not os.path.exists(preprocess_pipeline_path):
             raise FileNotFoundError(f"The file {preprocess_pipeline_path} does not exist")
 
-        # Load confs
-        with open(configuration_path, 'r', encoding='{{default_encoding}}') as f:
-            configs = json.load(f)
+        # Load confs (orjson only reads UTF-8, hence the backup on json)
+        configs = None
+        if orjson is not None:
+            with open(configuration_path, 'rb') as f:
+                try:
+                    configs = orjson.loads(f.read())
+                except orjson.JSONDecodeError:
+                    pass
+        if configs is None:
+            with open(configuration_path, 'r', encoding='{{default_encoding}}') as f:
+                configs = json.load(f)
 
         # Set class vars
         # self.model_name = # Keep the created name
@@ -147,10 +392,10 @@ class ModelDenseRegressor(ModelRegressorMixin, ModelKeras):
         self.nb_fit = configs.get('nb_fit', 1)  # Consider one unique fit by default
         self.trained = configs.get('trained', True)  # Consider trained by default
         # Try to read the following attributes from configs and, if absent, keep the current one
-        for attribute in ['model_type', 'x_col', 'y_col', 'columns_in', 'mandatory_columns',
-                          'level_save', 'batch_size', 'epochs', 'validation_split', 'patience',
-                          'keras_params']:
-            setattr(self, attribute, configs.get(attribute, getattr(self, attribute)))
+        attributes = frozenset(['model_type', 'x_col', 'y_col', 'columns_in', 'mandatory_columns',
+                                'level_save', 'batch_size', 'epochs', 'validation_split', 'patience',
+                                'keras_params'])
+        self.__dict__.update({attribute: configs[attribute] for attribute in configs.keys() & attributes})
 
         # Reload model
         self.model = load_model_keras(hdf5_path, custom_objects=self.custom_objects)
@@ -160,8 +405,15 @@ class ModelDenseRegressor(ModelRegressorMixin, ModelKeras):
         shutil.copyfile(hdf5_path, new_hdf5_path)
 
         # Reload pipeline preprocessing
+        # The file is memory-mapped & read with the standard pickle, backup on dill if it does not work
         with open(preprocess_pipeline_path, 'rb') as f:
-            self.preprocess_pipeline = pickle.load(f)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.preprocess_pipeline = pickle.loads(mm)
+            except Exception:
+                self.preprocess_pipeline = dill.loads(mm)
+            finally:
+                mm.close()
 
 
 if __name__ == '__main__':
@@ -68,7 +68,8 @@ class Explainer:
 class ShapExplainer(Explainer):
     '''Shap Explainer wrapper class'''
 
-    def __init__(self, model: Type[ModelClass], anchor_data: pd.DataFrame, anchor_preprocessed: bool = False) -> None:
+    def __init__(self, model: Type[ModelClass], anchor_data: pd.DataFrame, anchor_preprocessed: bool = False,
+                 predict_kwargs: Union[dict, None] = None) -> None:
         ''' Initialization
 
         Args:
@@ -76,6 +77,8 @@ class ShapExplainer(Explainer):
             anchor_data (pd.DataFrame): data anchor needed by shap (usually 100 data points)
         Kwargs:
             anchor_preprocessed (bool): If the anchor data has already been preprocessed
+            predict_kwargs (dict): Additional arguments given to the model's predict / predict_proba functions
+                e.g. {'experimental_version': 'quantized'} for a ModelDenseRegressor
         Raises:
             TypeError: If the provided model is a regressor and does not implement a `predict` function
             TypeError: If the provided model is a classifier and does not implement a `predict_proba` function
@@ -95,6 +98,13 @@ class ShapExplainer(Explainer):
         # Set attributes
         self.model = model
         self.model_type = model.model_type
+        self.predict_kwargs = predict_kwargs if predict_kwargs is not None else {}
+        # Experimental versions are built before the explanations loop, if the model allows it
+        experimental_version = self.predict_kwargs.get('experimental_version', False)
+        if experimental_version and callable(getattr(model, 'warm_up_predict', None)):
+            model.warm_up_predict(experimental_version=experimental_version)  # type: ignore
+        # Keras models work on float32 arrays: we convert the inputs once (contiguous) to avoid a copy for each call
+        self.input_as_float32 = hasattr(model, 'keras_params')
         # Our explainers will explain a prediction for a given class / label
         # These atributes are set on the fly and will change the proba function used by the explainer
         self.current_class_or_label_index = 0
@@ -125,7 +135,7 @@ class ShapExplainer(Explainer):
         '''
         # Get probabilities
         # Mypy raises a false error here, needs to be ignored
-        return self.model.predict_proba(content_prep)[:, self.current_class_or_label_index]  # type: ignore
+        return self.model.predict_proba(self._format_content(content_prep), **self.predict_kwargs)[:, self.current_class_or_label_index]  # type: ignore
 
     def regressor_fn(self, content_prep: pd.DataFrame) -> np.ndarray:
         '''Function to get predictions from a dataset (already preprocessed) - regressors
@@ -137,7 +147,21 @@ class ShapExplainer(Explainer):
         '''
         # Get predictions
         # Mypy raises a false error here, needs to be ignored
-        return self.model.predict(content_prep)  # type: ignore
+        return self.model.predict(self._format_content(content_prep), **self.predict_kwargs)  # type: ignore
+
+    def _format_content(self, content_prep: Union[pd.DataFrame, np.ndarray]) -> Union[pd.DataFrame, np.ndarray]:
+        '''Formats a dataset (already preprocessed) before giving it to the model
+
+        Arrays given by shap are converted into float32 C-contiguous arrays for Keras models, other inputs are kept as is.
+
+        Args:
+            content_prep (pd.DataFrame | np.ndarray): dataset (already preprocessed) to be considered
+        Returns:
+            pd.DataFrame | np.ndarray: formatted dataset
+        '''
+        if self.input_as_float32 and isinstance(content_prep, np.ndarray):
+            return np.ascontiguousarray(content_prep, dtype=np.float32)
+        return content_prep
 
     def explain_instance(self, content: pd.DataFrame, class_or_label_index: Union[int, None] = None, **kwargs) -> Any:
         '''Explains a prediction
@@ -18,12 +18,15 @@
 import unittest
 from unittest.mock import Mock
 from unittest.mock import patch
+from unittest.mock import call
 
 # Utils libs
 import os
 import json
 import shutil
+import threading
 import tensorflow
+import dill as pickle
 import numpy as np
 import pandas as pd
 import tensorflow.keras as keras
@@ -115,6 +118,32 @@ class ModelDenseRegressorTests(unittest.TestCase):
             probas = model.predict(x_train, return_proba=True)
         preds = model.predict(x_train, return_proba=False, experimental_version=True)
         self.assertEqual(preds.shape, (len(x_train),))
+        np.testing.assert_almost_equal(preds, model.predict(x_train, return_proba=False), decimal=5)
+        # The traced forward pass is built & warmed up, and reused (not traced again) with other batch sizes
+        model._predict_tf = None
+        model.warm_up_predict(experimental_version=False)
+        self.assertTrue(model._predict_tf is None)
+        model.warm_up_predict()
+        predict_tf = model._get_predict_tf()
+        self.assertEqual(predict_tf.experimental_get_tracing_count(), 1)
+        preds = model.predict(x_train.iloc[:3], return_proba=False, experimental_version=True)
+        self.assertEqual(preds.shape, (3,))
+        self.assertTrue(model._get_predict_tf() is predict_tf)
+        self.assertEqual(predict_tf.experimental_get_tracing_count(), 1)
+        # Quantized version
+        preds_quant = model._quant_predict(x_train)
+        self.assertEqual(preds_quant.shape, (len(x_train), 1))
+        np.testing.assert_allclose(preds_quant[:, 0], model.predict(x_train, return_proba=False), atol=0.5)
+        preds_quant = model.predict(x_train, experimental_version='quantized')
+        self.assertEqual(preds_quant.shape, (len(x_train),))
+        np.testing.assert_allclose(preds_quant, model.predict(x_train, return_proba=False), atol=0.5)
+        # Other batch size (input resized)
+        preds_quant = model.predict(x_train.iloc[:3], experimental_version='quantized')
+        self.assertEqual(preds_quant.shape, (3,))
+        with patch('tensorflow.lite.TFLiteConverter.from_keras_model', side_effect=ValueError('error')):
+            model._quant_interpreter = None
+            preds_quant = model._quant_predict(x_train)
+            self.assertEqual(preds_quant.shape, (len(x_train), 1))
         with self.assertRaises(ValueError):
             probas = model.predict(x_train, return_proba=True, experimental_version=True)
         # Test inversed columns order
@@ -122,6 +151,16 @@ class ModelDenseRegressorTests(unittest.TestCase):
         np.testing.assert_almost_equal(preds, preds_inv, decimal=5)
         remove_dir(model_dir)
 
+        # Two fits with level_save='LOW' (same Keras model) -> the experimental version uses the new weights
+        model = ModelDenseRegressor(x_col=x_col, y_col=y_col_mono, model_dir=model_dir, batch_size=8, epochs=2, level_save='LOW')
+        model.fit(x_train, y_train_regressor)
+        keras_model = model.model
+        model.fit(x_train, y_train_regressor)
+        self.assertTrue(model.model is keras_model)
+        np.testing.assert_almost_equal(model.predict(x_train, experimental_version=True), model.predict(x_train), decimal=4)
+        remove_dir(model.model_dir)
+        remove_dir(model_dir)
+
         # Model needs to be fitted
         with self.assertRaises(AttributeError):
             model = ModelDenseRegressor(x_col=x_col, y_col=y_col_mono, model_dir=model_dir, batch_size=8, epochs=2)
@@ -144,6 +183,42 @@ class ModelDenseRegressorTests(unittest.TestCase):
         model_res = model._get_model()
         self.assertTrue(isinstance(model_res, keras.Model))
 
+        # Model png saved in a background thread
+        model._save_png_thread.join()
+        with patch.object(ModelDenseRegressor, '_save_model_png') as mock_save_png:
+            model_res = model._get_model()
+            model._save_png_thread.join()
+            mock_save_png.assert_called_once_with(model_res)
+        # A new model waits for the png of the previous one (not dropped), and save waits for the png
+        event = threading.Event()
+        with patch.object(ModelDenseRegressor, '_save_model_png', side_effect=lambda _: event.wait(5)) as mock_save_png:
+            model_res_1 = model._get_model()
+            first_thread = model._save_png_thread
+            self.assertTrue(first_thread.is_alive())
+            threading.Timer(0.5, event.set).start()
+            model_res_2 = model._get_model()
+            self.assertFalse(first_thread.is_alive())
+            model.save()
+            self.assertFalse(model._save_png_thread.is_alive())
+            self.assertEqual(mock_save_png.call_args_list, [call(model_res_1), call(model_res_2)])
+        remove_dir(model_dir)
+        model = ModelDenseRegressor(x_col=x_col, y_col=y_col_mono, model_dir=model_dir, epochs=2)
+
+        # Inference model can't be built -> backup on the model itself
+        model.model = model_res
+        with patch.object(ModelDenseRegressor, '_get_inference_model', side_effect=ValueError('not a stack')):
+            predict_tf = model._get_predict_tf()
+        x = np.random.rand(10, len(x_col)).astype(np.float32)
+        np.testing.assert_almost_equal(predict_tf(x).numpy(), model_res(x, training=False).numpy(), decimal=5)
+        model.model = None
+
+        # Inference model
+        inference_model = model._get_inference_model(model_res)
+        self.assertTrue(isinstance(inference_model, keras.Model))
+        self.assertLess(len(inference_model.layers), len(model_res.layers))
+        x = np.random.rand(10, len(x_col)).astype(np.float32)
+        np.testing.assert_almost_equal(inference_model(x).numpy(), model_res(x, training=False).numpy(), decimal=4)
+
         # Clean
         remove_dir(model_dir)
 
@@ -167,6 +242,14 @@ class ModelDenseRegressorTests(unittest.TestCase):
         with open(os.path.join(model.model_dir, 'configurations.json'), 'r', encoding='{{default_encoding}}') as f:
             configs = json.load(f)
         self.assertEqual(configs['test'], 8)
+        # The lock of the quantized interpreter is not saved, but created again when the model is unpickled
+        self.assertTrue(model._quant_lock is not None)
+        with open(os.path.join(model.model_dir, f"{model.model_name}.pkl"), 'rb') as f:
+            unpickled_model = pickle.load(f)
+        self.assertTrue(unpickled_model._quant_lock is not None)
+        self.assertTrue(unpickled_model._quant_lock is not model._quant_lock)
+        with unpickled_model._quant_lock:
+            pass
         self.assertTrue('maintainers' in configs.keys())
         self.assertTrue('date' in configs.keys())
         self.assertTrue('package_version' in configs.keys())
@@ -306,9 +389,33 @@ class ModelDenseRegressorTests(unittest.TestCase):
         self.assertEqual(model.keras_params, new_model.keras_params)
         self.assertEqual(model.custom_objects, new_model.custom_objects)
         self.assertTrue(new_model.preprocess_pipeline is not None)
+        self.assertTrue(os.path.exists(os.path.join(new_model.model_dir, 'best.hdf5')))
         # We can't really test the pipeline so we test predictions
         self.assertEqual([[_] for _ in model.predict(x_train)], [[_] for _ in new_model.predict(x_train)])
         remove_dir(new_model.model_dir)
+
+        # A refit after a reload must not modify the source hdf5 file
+        with open(hdf5_path, 'rb') as f:
+            hdf5_content = f.read()
+        new_model = ModelDenseRegressor(batch_size=8, epochs=2)
+        new_model.reload_from_standalone(configuration_path=conf_path, hdf5_path=hdf5_path,
+                                         preprocess_pipeline_path=preprocess_pipeline_path)
+        reload_dir = new_model.model_dir
+        new_model.fit(x_train, y_train_regressor)
+        with open(hdf5_path, 'rb') as f:
+            self.assertEqual(f.read(), hdf5_content)
+        remove_dir(reload_dir)
+        remove_dir(new_model.model_dir)
+
+        # Same thing without orjson
+        with patch('{{package_name}}.models_training.regressors.model_dense_regressor.orjson', None):
+            new_model = ModelDenseRegressor()
+            new_model.reload_from_standalone(configuration_path=conf_path, hdf5_path=hdf5_path,
+                                             preprocess_pipeline_path=preprocess_pipeline_path)
+        self.assertEqual(model.x_col, new_model.x_col)
+        self.assertEqual(model.keras_params, new_model.keras_params)
+        self.assertEqual([[_] for _ in model.predict(x_train)], [[_] for _ in new_model.predict(x_train)])
+        remove_dir(new_model.model_dir)
         # We do not remove model_dir to test the errors
 
         ############################################
@@ -30,6 +30,7 @@ from {{package_name}} import utils
 from {{package_name}}.models_training import utils_models
 from {{package_name}}.monitoring.model_explainer import ShapExplainer
 from {{package_name}}.models_training.regressors.model_rf_regressor import ModelRFRegressor
+from {{package_name}}.models_training.regressors.model_dense_regressor import ModelDenseRegressor
 from {{package_name}}.models_training.classifiers.model_rf_classifier import ModelRFClassifier
 
 
@@ -162,6 +163,39 @@ class ModelExplainerTest(unittest.TestCase):
         html = explainer.explain_instance_as_html(content, class_or_label_index=None)
         remove_dir(model_dir)
 
+        # Additional predict arguments
+        model = ModelRFRegressor(x_col=x_col, y_col=y_col_mono, model_dir=model_dir)
+        model.fit(x_train, y_train_regressor)
+        explainer = ShapExplainer(model, anchor_data=x_train, anchor_preprocessed=False, predict_kwargs={'toto': 1})
+        with patch.object(model, 'predict', wraps=model.predict) as mock_predict:
+            explanation = explainer.explain_instance(content)
+            self.assertEqual(mock_predict.call_args[1], {'toto': 1})
+        remove_dir(model_dir)
+
+        # Inputs format - Keras models get float32 C-contiguous arrays, with the same predictions
+        model = ModelDenseRegressor(x_col=x_col, y_col=y_col_mono, model_dir=model_dir, batch_size=8, epochs=2)
+        model.fit(x_train, y_train_regressor)
+        explainer = ShapExplainer(model, anchor_data=x_train, anchor_preprocessed=False)
+        self.assertTrue(explainer.input_as_float32)
+        x_array = np.array(x_train, dtype=np.float64)
+        x_formatted = explainer._format_content(x_array)
+        self.assertEqual(x_formatted.dtype, np.float32)
+        self.assertTrue(x_formatted.flags['C_CONTIGUOUS'])
+        np.testing.assert_almost_equal(explainer.regressor_fn(x_array), model.predict(x_train), decimal=5)
+        self.assertTrue(explainer._format_content(x_train) is x_train)
+        # Experimental version -> forward pass warmed up when creating the explainer
+        self.assertTrue(model._predict_tf is None)
+        explainer = ShapExplainer(model, anchor_data=x_train, anchor_preprocessed=False, predict_kwargs={'experimental_version': True})
+        self.assertTrue(model._predict_tf is not None)
+        remove_dir(model_dir)
+        # Other models : inputs kept as is
+        model = ModelRFRegressor(x_col=x_col, y_col=y_col_mono, model_dir=model_dir)
+        model.fit(x_train, y_train_regressor)
+        explainer = ShapExplainer(model, anchor_data=x_train, anchor_preprocessed=False)
+        self.assertFalse(explainer.input_as_float32)
+        self.assertTrue(explainer._format_content(x_array) is x_array)
+        remove_dir(model_dir)
+
         # Check errors
         # Regressor withtout predict
         class FakeModelClass1():
@@ -98,6 +98,22 @@ class ModelKerasTests(unittest.TestCase):
         self.assertEqual(model.keras_params, {'toto': 5})
         remove_dir(model_dir)
 
+        # tf_threads : opt-in, the TensorFlow threads pools are not configured by default
+        with patch('tensorflow.config.threading.set_intra_op_parallelism_threads') as mock_intra, \
+             patch('tensorflow.config.threading.set_inter_op_parallelism_threads') as mock_inter:
+            model = ModelKeras(model_dir=model_dir)
+            mock_intra.assert_not_called()
+            mock_inter.assert_not_called()
+            remove_dir(model_dir)
+            model = ModelKeras(model_dir=model_dir, tf_threads=4)
+            mock_intra.assert_called_once_with(4)
+            mock_inter.assert_called_once_with(2)
+            remove_dir(model_dir)
+        # TensorFlow already initialized -> no error
+        with patch('tensorflow.config.threading.set_intra_op_parallelism_threads', side_effect=RuntimeError):
+            model = ModelKeras(model_dir=model_dir, tf_threads=4)
+            remove_dir(model_dir)
+
     def test02_model_keras_fit(self):
         '''Test of the method fit of {{package_name}}.models_training.model_keras.ModelKeras'''
         # /!\ We test with model_embedding_lstm /!\
@@ -574,6 +590,11 @@ class ModelKerasTests(unittest.TestCase):
         probas = model.predict_proba(x_train)
         self.assertEqual(probas.shape, (len(x_train), 3))  # 3 classes
         self.assertTrue(isinstance(probas[0][0], (np.floating, float)))
+        # Kwargs are given to predict
+        with patch.object(model, 'predict', wraps=model.predict) as mock_predict:
+            probas_exp = model.predict_proba(x_train, experimental_version=True)
+            self.assertEqual(mock_predict.call_args[1], {'return_proba': True, 'experimental_version': True})
+        np.testing.assert_almost_equal(probas, probas_exp, decimal=5)
         # Test inversed columns order
         probas_inv = model.predict_proba(x_train_inv)
         np.testing.assert_almost_equal(probas, probas_inv, decimal=5)